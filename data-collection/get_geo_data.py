@@ -1,30 +1,57 @@
 import os
-from collections import Counter
-from datetime import datetime, timedelta, timezone
-import requests
+import asyncio
+import random
+import sqlite3
 import time
-import json
+from datetime import datetime, timedelta, timezone
+import aiohttp
+import orjson
 import csv
 from pathlib import Path
 from pymongo import MongoClient
+from pymongo.errors import OperationFailure
 from dotenv import load_dotenv
 
 
-def get_database_connection():
-    """Initialize MongoDB connection"""
-    load_dotenv()
+load_dotenv()
+
+_MONGO_URI = (
+    f"mongodb+srv://{os.getenv('MONGOUSER')}:{os.getenv('MONGOPASS')}"
+    f"@{os.getenv('MONGO_URL')}/"
+)
+_MONGO_DB_NAME = os.getenv("DBNAME")
+_MONGO_CLIENT = None
+
+# Nominatim endpoint and minimum delay between requests. The public instance
+# allows 1 request/second; point NOMINATIM_BASE_URL at a self-hosted mirror
+# to lower NOMINATIM_MIN_INTERVAL accordingly.
+NOMINATIM_BASE_URL = os.getenv(
+    "NOMINATIM_BASE_URL", "https://nominatim.openstreetmap.org"
+).rstrip("/")
+NOMINATIM_MIN_INTERVAL = float(os.getenv("NOMINATIM_MIN_INTERVAL", "1.0"))
+# Number of requests allowed in flight at once; keep at 1 for the public instance
+NOMINATIM_CONCURRENCY = int(os.getenv("NOMINATIM_CONCURRENCY", "1"))
 
-    # MongoDB connection
-    mongo_user = os.getenv("MONGOUSER")
-    mongo_password = os.getenv("MONGOPASS")
-    mongo_name = os.getenv("DBNAME")
-    mongo_url = os.getenv("MONGO_URL")
+# Geocode cache. The JSON file is the previous cache format and is only read
+# once to seed a new SQLite cache.
+GEOCODE_DB_PATH = Path("./data/geocode.db")
+LEGACY_GEOCODE_CITY_CACHE_PATH = Path("./data/city_geocode_cache.json")
 
-    connection_string = f"mongodb+srv://{mongo_user}:{mongo_password}@{mongo_url}/"
-    mongo_client = MongoClient(connection_string)
-    mongo_db = mongo_client[mongo_name]
+# How long geocode cache entries stay valid before the city is looked up again.
+# Cities Nominatim could not find expire sooner in case they are added later.
+GEOCODE_CACHE_TTL = timedelta(days=180)
+GEOCODE_FAILURE_TTL = timedelta(days=7)
 
-    return mongo_db
+# Print geocoding progress every N cities instead of once per city
+GEOCODE_PROGRESS_EVERY = 50
+
+
+def get_database_connection():
+    """Return the MongoDB database, creating the shared client on first use"""
+    global _MONGO_CLIENT
+    if _MONGO_CLIENT is None:
+        _MONGO_CLIENT = MongoClient(_MONGO_URI)
+    return _MONGO_CLIENT[_MONGO_DB_NAME]
 
 
 def get_node_data(
@@ -54,174 +81,233 @@ def get_node_data(
             },
             {"is_datacenter": True},
         ],
+        "ip.city": {"$nin": [None, ""]},
     }
 
-    node_projection = {
-        "node_id": 1,
-        "cpu_cores": 1,
-        "wsl_memory": 1,
-        "available_disk": 1,
-        "gpus.card_name": 1,
-        "gpus.vram": 1,
-        "ncw_status": 1,
-        "ncw_detail": 1,
-        "ip.country_code": 1,
-        "ip.city": 1,
-        "ip.ndm_download": 1,
-        "ip.ndm_upload": 1,
-        "ip.ip_address": 1,
-        "is_running": 1,
-        "instances.workload_id": 1,
-        "instances.last_instance_state": 1,
-    }
+    # Apply optional filters in the query so excluded nodes never leave MongoDB
+    if filter_is_running:
+        node_query["is_running"] = True
+    if filter_has_workload:
+        node_query["instances"] = {"$elemMatch": {"workload_id": {"$nin": [None, ""]}}}
 
-    collection = mongo_db["nodes"]
-    node_results = collection.find(node_query, node_projection)
-    node_list = list(node_results)
+    filter_organizations = list(filter_organizations)
+    pipeline = [{"$match": node_query}]
 
     if filter_organizations:
-        workload_query = {}
-        workload_projection = {
-            "replica_count": 1,
-            "min_disk": 1,
-            "min_cpu": 1,
-            "gpu": 1,
-            "min_ram": 1,
-            "instances.status": 1,
-            "workload_id": 1,
-            "organization_name": 1,
-            "organization_id": 1,
-        }
-
-        collection = mongo_db["workloads"]
-        workload_results = collection.find(workload_query, workload_projection)
-        workload_list = list(workload_results)
-
-        # Create workload lookup by workload_id
-        workload_lookup = {}
-        for workload in workload_list:
-            workload_id = workload.get("workload_id")
-            if workload_id:
-                workload_lookup[workload_id] = {
-                    "organization_id": workload.get("organization_id"),
-                    "organization_name": workload.get("organization_name"),
+        # The $lookup below runs once per matched node; without this index each
+        # run scans the whole workloads collection. create_index is a no-op if
+        # the index already exists.
+        try:
+            mongo_db["workloads"].create_index("workload_id")
+        except OperationFailure as e:
+            print(f"Could not ensure an index on workloads.workload_id: {e}")
+
+        # Join each node's instances to their workloads inside MongoDB and keep
+        # only nodes running a workload owned by one of the requested organizations
+        pipeline += [
+            {
+                "$lookup": {
+                    "from": "workloads",
+                    "localField": "instances.workload_id",
+                    "foreignField": "workload_id",
+                    # A node without workload ids would otherwise join every
+                    # workload whose workload_id is null or missing
+                    "pipeline": [
+                        {"$match": {"workload_id": {"$nin": [None, ""]}}},
+                        {"$project": {"_id": 0, "organization_id": 1, "organization_name": 1}},
+                    ],
+                    "as": "workloads",
+                }
+            },
+            {
+                "$match": {
+                    "$or": [
+                        {"workloads.organization_id": {"$in": filter_organizations}},
+                        {"workloads.organization_name": {"$in": filter_organizations}},
+                    ]
                 }
+            },
+        ]
+
+    # Count nodes per city server-side so only one row per city is returned
+    pipeline.append({"$group": {"_id": "$ip.city", "count": {"$sum": 1}}})
 
-        # Add organization info to nodes based on instances.workload_id
-        for node in node_list:
-            instances = node.get("instances", [])
-            node["organization_names"] = set()
-            node["organization_ids"] = set()
-
-            for instance in instances:
-                workload_id = instance.get("workload_id")
-                if workload_id and workload_id in workload_lookup:
-                    org_info = workload_lookup[workload_id]
-                    if org_info["organization_id"]:
-                        node["organization_ids"].add(org_info["organization_id"])
-                    if org_info["organization_name"]:
-                        node["organization_names"].add(org_info["organization_name"])
-
-            # Convert sets to lists for easier handling
-            node["organization_ids"] = list(node["organization_ids"])
-            node["organization_names"] = list(node["organization_names"])
-
-    # Process and filter nodes
-    city_counter = Counter()
-
-    for node in node_list:
-        # Apply optional filters
-        if filter_has_workload:
-            instances = node.get("instances", [])
-            if not instances or not any(
-                instance.get("workload_id") for instance in instances
-            ):
-                continue
-
-        if filter_is_running:
-            if not node.get("is_running", False):
-                continue
-
-        if filter_organizations:
-            # Check if node has any of the specified organizations
-            node_org_ids = node.get("organization_ids", [])
-            node_org_names = node.get("organization_names", [])
-            if not any(
-                org_id in filter_organizations for org_id in node_org_ids
-            ) and not any(
-                org_name in filter_organizations for org_name in node_org_names
-            ):
-                continue
-
-        city = node.get("ip", {}).get("city", None)
-        if city:
-            city_counter[city] += 1
-
-    return city_counter
-
-
-def load_geocode_caches():
-    """Load existing geocode caches"""
-    GEOCODE_CITY_CACHE_PATH = Path("./data/city_geocode_cache.json")
-    if GEOCODE_CITY_CACHE_PATH.exists():
-        with open(GEOCODE_CITY_CACHE_PATH, "r", encoding="utf-8") as f:
-            geocode_city_cache = json.load(f)
-    else:
-        geocode_city_cache = {}
-
-    return geocode_city_cache
-
-
-def geocode_city(city_name, geocode_city_cache):
+    collection = mongo_db["nodes"]
+    city_results = collection.aggregate(pipeline, batchSize=1000)
+
+    return {row["_id"]: row["count"] for row in city_results}
+
+
+def open_geocode_cache():
+    """Open the SQLite geocode cache, seeding it from the legacy JSON cache if new"""
+    GEOCODE_DB_PATH.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(GEOCODE_DB_PATH)
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS geocode (
+            kind TEXT NOT NULL,
+            key TEXT NOT NULL,
+            lat REAL,
+            lon REAL,
+            fetched_at INTEGER NOT NULL,
+            PRIMARY KEY (kind, key)
+        )
+        """
+    )
+
+    is_empty = conn.execute("SELECT 1 FROM geocode LIMIT 1").fetchone() is None
+    if is_empty and LEGACY_GEOCODE_CITY_CACHE_PATH.exists():
+        # Legacy entries are {"lat", "lon", "fetched_at"} or a bare null for failed
+        # lookups. Entries without a timestamp get a random age within their TTL,
+        # so they come up for refresh spread over the window rather than in one
+        # run that re-fetches the whole cache.
+        legacy_cache = orjson.loads(LEGACY_GEOCODE_CITY_CACHE_PATH.read_bytes())
+        now = time.time()
+        rows = []
+        for city_name, entry in legacy_cache.items():
+            entry = entry or {}
+            fetched_at = entry.get("fetched_at")
+            if fetched_at:
+                fetched_at = int(datetime.fromisoformat(fetched_at).timestamp())
+            else:
+                ttl = GEOCODE_CACHE_TTL if entry.get("lat") is not None else GEOCODE_FAILURE_TTL
+                fetched_at = int(now - random.uniform(0, ttl.total_seconds()))
+            rows.append(("city", city_name, entry.get("lat"), entry.get("lon"), fetched_at))
+        with conn:
+            conn.executemany("INSERT OR REPLACE INTO geocode VALUES (?, ?, ?, ?, ?)", rows)
+        print(f"Seeded geocode cache with {len(rows)} cities from {LEGACY_GEOCODE_CITY_CACHE_PATH}")
+
+    return conn
+
+
+def get_cached_geocode(geocode_cache, kind, key):
+    """
+    Look up a fresh geocode cache entry.
+
+    Returns a (lat, lon) tuple, with both None for a remembered failed lookup,
+    or None if there is no entry or it has outlived its TTL.
+    """
+    now = time.time()
+    return geocode_cache.execute(
+        """
+        SELECT lat, lon FROM geocode
+        WHERE kind = ? AND key = ?
+          AND fetched_at > CASE WHEN lat IS NULL THEN ? ELSE ? END
+        """,
+        (
+            kind,
+            key,
+            now - GEOCODE_FAILURE_TTL.total_seconds(),
+            now - GEOCODE_CACHE_TTL.total_seconds(),
+        ),
+    ).fetchone()
+
+
+def get_stale_geocode(geocode_cache, kind, key):
+    """Return the (lat, lon) of a previous successful lookup of any age, or None"""
+    return geocode_cache.execute(
+        "SELECT lat, lon FROM geocode WHERE kind = ? AND key = ? AND lat IS NOT NULL",
+        (kind, key),
+    ).fetchone()
+
+
+def set_cached_geocode(geocode_cache, kind, key, lat, lon):
+    """Insert or refresh a geocode cache entry"""
+    geocode_cache.execute(
+        "INSERT OR REPLACE INTO geocode VALUES (?, ?, ?, ?, ?)",
+        (kind, key, lat, lon, int(time.time())),
+    )
+
+
+async def geocode_city(session, semaphore, city_name, geocode_cache):
     """Geocode a city name using OpenStreetMap Nominatim API"""
-    if city_name in geocode_city_cache:
-        return geocode_city_cache[city_name]
+    cached = get_cached_geocode(geocode_cache, "city", city_name)
+    if cached is not None:
+        lat, lon = cached
+        return {"lat": lat, "lon": lon} if lat is not None else None
     if city_name == "N/A" or not city_name:
         return None
 
-    url = f"https://nominatim.openstreetmap.org/search?city={city_name}&format=json&limit=1"
-    try:
-        resp = requests.get(url, headers={"User-Agent": "SaladCloudStats/1.0"})
-        if resp.status_code == 200:
-            data = resp.json()
-            if data:
-                lat = float(data[0]["lat"])
-                lon = float(data[0]["lon"])
-                geocode_city_cache[city_name] = {"lat": lat, "lon": lon}
-                time.sleep(2)  # Be polite to API
-                return geocode_city_cache[city_name]
-    except Exception as e:
-        print(f"Geocoding error for {city_name}: {e}")
-    geocode_city_cache[city_name] = None
+    # Coordinates from an expired entry are kept if the refresh fails
+    stale = get_stale_geocode(geocode_cache, "city", city_name)
+
+    url = f"{NOMINATIM_BASE_URL}/search?city={city_name}&format=json&limit=1"
+    async with semaphore:
+        try:
+            async with session.get(url) as resp:
+                if resp.status == 200:
+                    data = await resp.json(content_type=None)
+                    if data:
+                        lat = float(data[0]["lat"])
+                        lon = float(data[0]["lon"])
+                    elif stale:
+                        lat, lon = stale
+                    else:
+                        # Only a definite "not found" is remembered as a failure
+                        lat = lon = None
+                    set_cached_geocode(geocode_cache, "city", city_name, lat, lon)
+                    return {"lat": lat, "lon": lon} if lat is not None else None
+                print(f"Geocoding error for {city_name}: HTTP {resp.status}")
+        except Exception as e:
+            print(f"Geocoding error for {city_name}: {e}")
+        finally:
+            await asyncio.sleep(NOMINATIM_MIN_INTERVAL)  # Be polite to API
+
+    # Rate limits, server errors and timeouts are not cached, so the city is
+    # retried on the next run
+    if stale:
+        lat, lon = stale
+        return {"lat": lat, "lon": lon}
     return None
 
 
+async def geocode_cities(city_names, geocode_cache):
+    """Geocode many cities over one HTTP session, rate limited by a semaphore"""
+    semaphore = asyncio.Semaphore(NOMINATIM_CONCURRENCY)
+    total_cities = len(city_names)
+    completed = 0
+
+    async def geocode_with_progress(session, city):
+        nonlocal completed
+        geo = await geocode_city(session, semaphore, city, geocode_cache)
+        completed += 1
+        if completed % GEOCODE_PROGRESS_EVERY == 0 or completed == total_cities:
+            print(f"[{completed}/{total_cities}] Geocoded: {city}")
+        return geo
+
+    async with aiohttp.ClientSession(
+        headers={"User-Agent": "SaladCloudStats/1.0"},
+        timeout=aiohttp.ClientTimeout(total=10),
+    ) as session:
+        return await asyncio.gather(
+            *(geocode_with_progress(session, city) for city in city_names)
+        )
+
+
 def add_lat_long_to_data(city_counter):
     """Add latitude and longitude coordinates to location data"""
-    geocode_city_cache = load_geocode_caches()
+    geocode_cache = open_geocode_cache()
 
     # Process cities
     output_rows_city = []
-    total_cities = len(city_counter)
-    print(f"Geocoding {total_cities} cities...")
-    for idx, (city, count) in enumerate(city_counter.items(), 1):
-        print(f"[{idx}/{total_cities}] Geocoding: {city}")
-        geo = geocode_city(city, geocode_city_cache)
+    print(f"Geocoding {len(city_counter)} cities...")
+    try:
+        geo_results = asyncio.run(geocode_cities(list(city_counter), geocode_cache))
+    finally:
+        # Keep whatever was fetched, even if the run was interrupted
+        geocode_cache.commit()
+        geocode_cache.close()
+
+    for (city, count), geo in zip(city_counter.items(), geo_results):
         if geo:
             output_rows_city.append(
                 {"city": city, "count": count, "lat": geo["lat"], "lon": geo["lon"]}
             )
         else:
             output_rows_city.append(
-                {"city": city, "count": count, "lat": "", "lon": ""}
+                {"city": city, "count": count, "lat": None, "lon": None}
             )
     print("City geocoding complete.")
-
-    # Update geocode caches
-    GEOCODE_CITY_CACHE_PATH = Path("./data/city_geocode_cache.json")
-
-    with open(GEOCODE_CITY_CACHE_PATH, "w", encoding="utf-8") as f:
-        json.dump(geocode_city_cache, f, ensure_ascii=False, indent=2)
     return output_rows_city
 
 
@@ -232,22 +318,19 @@ def save_data_to_files(output_rows_city):
 
     # Write CSV file for pgAdmin import
     csv_filename = "./data/city_data.csv"
-    with open(csv_filename, "w", encoding="utf-8", newline="") as f:
+    with open(
+        csv_filename, "w", encoding="utf-8", newline="", buffering=1024 * 1024
+    ) as f:
         writer = csv.writer(f)
 
-        exported_count = 0
-        for row in output_rows_city:
-            if row["lat"] and row["lon"]:  # Only include geocoded cities
-                writer.writerow(
-                    [
-                        timestamp_str,
-                        row["city"],
-                        row["count"],
-                        float(row["lat"]),
-                        float(row["lon"]),
-                    ]
-                )
-                exported_count += 1
+        # Only include geocoded cities
+        rows = [
+            (timestamp_str, row["city"], row["count"], row["lat"], row["lon"])
+            for row in output_rows_city
+            if row["lat"] is not None
+        ]
+        writer.writerows(rows)
+        exported_count = len(rows)
 
     print(f"✅ Exported {exported_count} city records to {csv_filename}")
     print(
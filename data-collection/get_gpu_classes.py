@@ -1,9 +1,12 @@
 import os
-import requests
-import json
+import re
 import csv
 from datetime import datetime
 from dotenv import load_dotenv
+from strapi_client import StrapiClient
+
+# VRAM size embedded in a GPU class name, e.g. "RTX 4090 (24 GB)"
+VRAM_GB_RE = re.compile(r"\(\s*(\d+)\s*GB")
 
 
 def main():
@@ -14,35 +17,9 @@ def main():
     strapi_name = os.getenv("STRAPIID")
     strapi_url = os.getenv("STRAPIURL")
 
-    def getStrapiJwt():
-        response = requests.post(
-            strapi_url + "/auth/local",
-            headers={"Content-Type": "application/json", "Accept": "application/json"},
-            json={"identifier": strapi_name, "password": strapi_password},
-        )
-        response.raise_for_status()
-
-        jsonResponse = response.json()
-        return jsonResponse["jwt"]
-
-    strapiJwt = getStrapiJwt()
-
-    def getGpuClasses():
-        response = requests.get(
-            strapi_url + "/gpu-classes",
-            headers={
-                "Content-Type": "application/json",
-                "Accept": "application/json",
-                "Authorization": "Bearer " + strapiJwt,
-            },
-        )
-        jsonResponse = response.json()
-        output = {}
-        for j in jsonResponse:
-            output[j["uuid"]] = j
-        return output
-
-    published_gpu_classes = getGpuClasses()
+    client = StrapiClient(strapi_url, strapi_name, strapi_password)
+    published_gpu_classes = client.get_gpu_classes()
+    client.close()
 
     # Process and format GPU classes for export
     gpu_classes_data = []
@@ -50,12 +27,9 @@ def main():
         # Preprocess vram_gb value
         vram_gb = gpu.get("vram_gb")
         if vram_gb is None:
-            name = gpu.get("name", "")
-            if "(" in name and "GB" in name:
-                try:
-                    vram_gb = int(name.split("(")[-1].split("GB")[0].strip())
-                except Exception:
-                    vram_gb = None
+            match = VRAM_GB_RE.search(gpu.get("name") or "")
+            if match:
+                vram_gb = int(match.group(1))
 
         gpu_data = {
             "gpu_class_id": uuid,
@@ -71,22 +45,24 @@ def main():
 
     # Write to CSV file for pgAdmin import
     csv_filename = "gpu_classes.csv"
-    with open(csv_filename, "w", encoding="utf-8", newline="") as f:
+    with open(
+        csv_filename, "w", encoding="utf-8", newline="", buffering=1024 * 1024
+    ) as f:
         writer = csv.writer(f)
 
-        for gpu_data in gpu_classes_data:
-            writer.writerow(
-                [
-                    gpu_data["gpu_class_id"],
-                    gpu_data["batch_price"],
-                    gpu_data["low_price"],
-                    gpu_data["medium_price"],
-                    gpu_data["high_price"],
-                    gpu_data["gpu_type"],
-                    gpu_data["gpu_class_name"],
-                    gpu_data["vram_gb"],
-                ]
+        writer.writerows(
+            (
+                gpu_data["gpu_class_id"],
+                gpu_data["batch_price"],
+                gpu_data["low_price"],
+                gpu_data["medium_price"],
+                gpu_data["high_price"],
+                gpu_data["gpu_type"],
+                gpu_data["gpu_class_name"],
+                gpu_data["vram_gb"],
             )
+            for gpu_data in gpu_classes_data
+        )
 
     print(f"✅ Exported {len(gpu_classes_data)} GPU classes to {csv_filename}")
     print(f"📊 Source: {strapi_url}")
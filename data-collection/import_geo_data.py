@@ -9,9 +9,9 @@ Simple script to import city data from JSON backup files.
 """
 
 import argparse
-import json
 import os
 import sys
+import orjson
 from shared_geo_db import save_geo_data_to_database
 
 
@@ -28,12 +28,12 @@ def import_city_data_from_json(file_path, clear_existing=True):
     """
     # Load JSON file
     try:
-        with open(file_path, "r", encoding="utf-8") as f:
-            data = json.load(f)
+        with open(file_path, "rb") as f:
+            data = orjson.loads(f.read())
     except FileNotFoundError:
         print(f"❌ File not found: {file_path}")
         return 0
-    except json.JSONDecodeError as e:
+    except orjson.JSONDecodeError as e:
         print(f"❌ Invalid JSON file: {e}")
         return 0
     except Exception as e:
@@ -17,15 +17,23 @@ Requires environment variables (via .env or environment):
 
 import argparse
 import csv
+import io
 import os
 import sys
 from datetime import datetime
 import psycopg2
+from psycopg2 import sql
 from psycopg2.extras import execute_values
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# node_plan columns loaded from the CSV (id is generated by the database)
+NODE_PLAN_COLUMNS = (
+    "org_name, node_id, json_import_file_id, start_at, stop_at, "
+    "invoice_amount, usd_per_hour, gpu_class_id, ram, cpu"
+)
+
 
 def get_db_conn():
     """Create PostgreSQL connection."""
@@ -74,6 +82,32 @@ def ensure_json_import_file_records(cursor, json_import_file_ids, input_file_pat
         print(f"✅ Created {len(missing_ids)} json_import_file records")
 
 
+def drop_secondary_indexes(cursor, table):
+    """Drop indexes on a table that don't back a constraint and return their definitions."""
+    cursor.execute(
+        """
+        SELECT ic.relname, pg_get_indexdef(ix.indexrelid)
+        FROM pg_index ix
+        JOIN pg_class ic ON ic.oid = ix.indexrelid
+        WHERE ix.indrelid = %s::regclass
+          AND NOT EXISTS (SELECT 1 FROM pg_constraint c WHERE c.conindid = ix.indexrelid)
+        """,
+        (table,),
+    )
+    indexes = cursor.fetchall()
+    for index_name, _ in indexes:
+        cursor.execute(sql.SQL("DROP INDEX {}").format(sql.Identifier(index_name)))
+    return [index_def for _, index_def in indexes]
+
+
+def recreate_indexes(cursor, index_defs):
+    """Recreate indexes from their CREATE INDEX definitions."""
+    cursor.execute("SET LOCAL maintenance_work_mem = '1GB';")
+    cursor.execute("SET LOCAL max_parallel_maintenance_workers = 4;")
+    for index_def in index_defs:
+        cursor.execute(index_def)
+
+
 def parse_plan_row(row):
     """Parse CSV row into node plan data."""
     try:
@@ -196,12 +230,22 @@ def import_node_plans(file_path, clear_table=False, dry_run=False):
             f"Database: {os.getenv('POSTGRES_HOST', 'localhost')}:{os.getenv('POSTGRES_PORT', 5432)}/{os.getenv('POSTGRES_DB', 'statsdb')}"
         )
 
+        # The whole import is one transaction committed at the end; don't wait
+        # for the WAL flush on that commit, a failed import is simply re-run
+        cursor.execute("SET LOCAL synchronous_commit = off;")
+
         # Clear table if requested
         if clear_table:
             print("🗑️  Clearing existing node plan data...")
             cursor.execute("TRUNCATE node_plan RESTART IDENTITY CASCADE;")
             print("✅ Table cleared")
 
+        # On a full reload, building indexes once after the load is cheaper
+        # than maintaining them row by row during it
+        dropped_indexes = []
+        if clear_table and plans:
+            dropped_indexes = drop_secondary_indexes(cursor, "node_plan")
+
         # Import plans in batches
         if plans:
             print(f"\n📥 Importing {len(plans)} node plans...")
@@ -217,11 +261,22 @@ def import_node_plans(file_path, clear_table=False, dry_run=False):
             if json_import_file_ids:
                 ensure_json_import_file_records(cursor, json_import_file_ids, file_path)
 
-            # Prepare data for batch insert
-            values = []
-            for plan in plans:
-                values.append(
-                    (
+            # COPY rows into a temporary staging table, then merge them into
+            # node_plan with a single INSERT ... SELECT
+            cursor.execute(
+                f"""
+                CREATE TEMP TABLE node_plan_stage ON COMMIT DROP AS
+                SELECT {NODE_PLAN_COLUMNS} FROM node_plan WITH NO DATA
+            """
+            )
+
+            # csv.writer renders None and "" the same way, so NULLs are written
+            # as \N explicitly and empty strings stay empty strings
+            buffer = io.StringIO()
+            csv.writer(buffer).writerows(
+                tuple(
+                    r"\N" if value is None else value
+                    for value in (
                         plan["org_name"],
                         plan["node_id"],
                         plan["json_import_file_id"],
@@ -234,19 +289,30 @@ def import_node_plans(file_path, clear_table=False, dry_run=False):
                         plan["cpu"],
                     )
                 )
+                for plan in plans
+            )
+            buffer.seek(0)
+            cursor.copy_expert(
+                f"COPY node_plan_stage ({NODE_PLAN_COLUMNS}) FROM STDIN "
+                r"WITH (FORMAT csv, NULL '\N')",
+                buffer,
+            )
 
-            # Use upsert to handle conflicts (node_plan has auto-incrementing primary key)
-            insert_sql = """
-                INSERT INTO node_plan 
-                (org_name, node_id, json_import_file_id, start_at, stop_at, 
-                 invoice_amount, usd_per_hour, gpu_class_id, ram, cpu)
-                VALUES %s
+            # Skip conflicting rows as before (node_plan has auto-incrementing primary key)
+            cursor.execute(
+                f"""
+                INSERT INTO node_plan ({NODE_PLAN_COLUMNS})
+                SELECT {NODE_PLAN_COLUMNS} FROM node_plan_stage
                 ON CONFLICT DO NOTHING
             """
-
-            execute_values(cursor, insert_sql, values, template=None, page_size=1000)
+            )
             print(f"✅ Imported {len(plans)} node plans")
 
+            if dropped_indexes:
+                print(f"🔧 Rebuilding {len(dropped_indexes)} node_plan indexes...")
+                recreate_indexes(cursor, dropped_indexes)
+                cursor.execute("ANALYZE node_plan;")
+
             # Show some stats
             cursor.execute("SELECT COUNT(*) FROM node_plan;")
             total_count = cursor.fetchone()[0]
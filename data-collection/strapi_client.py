@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Shared Strapi CMS client.
+
+Holds one HTTP session and authenticates lazily, so a process that makes
+several Strapi calls only pays for a single /auth/local request. The JWT is
+also cached on disk and reused by later runs until shortly before it expires.
+"""
+
+import base64
+import functools
+import json
+import os
+import time
+from pathlib import Path
+import requests
+
+DEFAULT_JWT_CACHE_PATH = "~/.cache/salad/strapi_jwt.json"
+
+# Re-authenticate when the cached JWT expires within this many seconds
+JWT_EXPIRY_MARGIN = 60
+
+
+def get_jwt_expiry(token):
+    """Return the exp claim of a JWT as a unix timestamp, or 0 if unreadable."""
+    try:
+        payload = token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        return int(json.loads(base64.urlsafe_b64decode(payload))["exp"])
+    except (IndexError, KeyError, TypeError, ValueError):
+        return 0
+
+
+class StrapiClient:
+    """Strapi API client with a lazily fetched JWT."""
+
+    def __init__(self, base_url, identifier, password):
+        self.base_url = base_url
+        self.identifier = identifier
+        self.password = password
+        # Resolved here rather than at import so a STRAPI_JWT_CACHE loaded
+        # from .env after importing this module is still honoured
+        self.jwt_cache_path = Path(
+            os.getenv("STRAPI_JWT_CACHE", DEFAULT_JWT_CACHE_PATH)
+        ).expanduser()
+        self.session = requests.Session()
+        self.session.headers.update(
+            {"Content-Type": "application/json", "Accept": "application/json"}
+        )
+
+    @functools.cached_property
+    def jwt(self):
+        """Return a valid JWT, from the disk cache or by authenticating against Strapi."""
+        cached_jwt = self._load_cached_jwt()
+        if cached_jwt:
+            return cached_jwt
+
+        response = self.session.post(
+            self.base_url + "/auth/local",
+            json={"identifier": self.identifier, "password": self.password},
+        )
+        response.raise_for_status()
+        jwt = response.json()["jwt"]
+        self._save_cached_jwt(jwt)
+        return jwt
+
+    def _load_cached_jwt(self):
+        try:
+            cached = json.loads(self.jwt_cache_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+        if not isinstance(cached, dict):
+            return None
+        if cached.get("base_url") != self.base_url or cached.get("identifier") != self.identifier:
+            return None
+        jwt = cached.get("jwt")
+        if not jwt or get_jwt_expiry(jwt) <= time.time() + JWT_EXPIRY_MARGIN:
+            return None
+        return jwt
+
+    def _save_cached_jwt(self, jwt):
+        try:
+            self.jwt_cache_path.parent.mkdir(parents=True, exist_ok=True)
+            # Create the file owner-only, and tighten an existing file too since
+            # os.open only applies the mode when it creates the file
+            fd = os.open(self.jwt_cache_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            os.chmod(self.jwt_cache_path, 0o600)
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(
+                    {"base_url": self.base_url, "identifier": self.identifier, "jwt": jwt}, f
+                )
+        except OSError as e:
+            print(f"Could not cache Strapi JWT: {e}")
+
+    def get(self, path):
+        """GET an API path, re-authenticating once if the JWT was rejected."""
+        response = self._get(path)
+        if response.status_code == 401:
+            self.jwt_cache_path.unlink(missing_ok=True)
+            self.__dict__.pop("jwt", None)
+            response = self._get(path)
+        return response
+
+    def _get(self, path):
+        return self.session.get(
+            self.base_url + path, headers={"Authorization": "Bearer " + self.jwt}
+        )
+
+    def get_gpu_classes(self):
+        """Fetch published GPU classes keyed by uuid."""
+        response = self.get("/gpu-classes")
+        return {gpu["uuid"]: gpu for gpu in response.json()}
+
+    def close(self):
+        """Close the underlying HTTP session."""
+        self.session.close()